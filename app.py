@@ -1,21 +1,144 @@
-from flask import Flask, render_template, request, redirect, url_for, session
-import random
-import string
+from flask import (
+    Flask, Response, abort, before_render_template, g, jsonify, render_template,
+    request, redirect, template_rendered, url_for, session
+)
+import os
+import threading
+import time
+
+import metrics
+import rules
+from codes import CodeAllocator, CodesExhausted
+from models import FINISHED, P1, P2, PLAYING, SECRETS, STATUSES, Game, is_number
+from store import open_store
 
 app = Flask(__name__)
 app.secret_key = "super-secret-key"
 
-games = {}
+store = open_store()
+codes = CodeAllocator(store)
+metrics.register_store(store)
 
-# ---------------- HELPERS ----------------
+# When set, any request with ?profile=1 returns the sampled stacks of its own
+# handling (collapsed flamegraph format) instead of its normal response.
+PROFILE_REQUESTS = os.environ.get("PROFILE_REQUESTS") == "1"
+
+ROLE_INDEX = {"P1": P1, "P2": P2}
 
-def generate_game_code():
-    return ''.join(random.choices(string.ascii_uppercase + string.digits, k=4))
+# ---------------- HELPERS ----------------
 
-def evaluate_guess(secret, guess):
-    correct_position = sum(s == g for s, g in zip(secret, guess))
-    correct_digits = sum(min(secret.count(d), guess.count(d)) for d in set(guess))
-    return correct_digits, correct_position
+# Both return the version read together with the game. Pages subscribe to
+# /events from that version, so a change landing after the read still
+# reaches them.
+
+def load_game(game_code):
+    game, version = store.get(game_code)
+    if game is None or game.nonce != session.get("game_nonce"):
+        abort(404)
+    return game, version
+
+def update_game(game_code, change, nonce):
+    game, version, changed = store.update(game_code, change, nonce)
+    if changed:
+        notify_game(game_code)
+    return game, version, changed
+
+# ---------------- PUSH UPDATES ----------------
+
+# Every write to a game bumps its version in the store. Clients hold an
+# /events stream open and are only woken when that version moves, so idle
+# games cost a parked greenlet instead of a full page render every 2s. Each
+# stream stays open for as long as its page, so run gunicorn with
+# gunicorn.conf.py (gevent workers); thread-per-request workers run out of
+# threads after a few hundred open pages. Writes from other workers are not
+# signalled in-process, so for shared stores one poller thread per process
+# looks up the versions of every waited-on game in a single query every
+# SHARED_POLL_SECONDS and wakes the ones that moved.
+KEEPALIVE_SECONDS = 15
+SHARED_POLL_SECONDS = 1
+
+_waiters = {}
+_polled = {}  # version each waited-on game had when its waiter registered
+_waiters_lock = threading.Lock()
+_poller = None
+
+def notify_game(game_code):
+    with _waiters_lock:
+        event = _waiters.pop(game_code, None)
+        _polled.pop(game_code, None)
+    if event:
+        event.set()
+
+def wait_for_change(game_code, seen, timeout):
+    with _waiters_lock:
+        event = _waiters.setdefault(game_code, threading.Event())
+    version = store.version(game_code)
+    if version != seen:
+        return version
+    if store.shared:
+        with _waiters_lock:
+            if _waiters.get(game_code) is event:
+                _polled.setdefault(game_code, version)
+        start_poller()
+    event.wait(timeout)
+    return store.version(game_code)
+
+def start_poller():
+    global _poller
+    with _waiters_lock:
+        if _poller is None:
+            _poller = threading.Thread(target=poll_shared_store, daemon=True)
+            _poller.start()
+
+def poll_shared_store():
+    while True:
+        time.sleep(SHARED_POLL_SECONDS)
+        with _waiters_lock:
+            polled = dict(_polled)
+        if not polled:
+            continue
+        current = store.versions(polled)
+        for game_code, version in polled.items():
+            if current.get(game_code, 0) != version:
+                notify_game(game_code)
+
+# Evicted games drop their waiter entry and wake any open streams, which then
+# see version 0 and close.
+store.on_evict(notify_game)
+
+# ---------------- INSTRUMENTATION ----------------
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    if PROFILE_REQUESTS and request.args.get("profile") == "1":
+        g.profiler = metrics.SamplingProfiler(threading.get_ident()).start()
+
+@app.after_request
+def record_request(response):
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    metrics.REQUESTS.inc(route, request.method, str(response.status_code))
+    metrics.REQUEST_SECONDS.observe(time.perf_counter() - g.request_start, route)
+    profiler = g.pop("profiler", None)
+    if profiler:
+        return Response(profiler.stop(), mimetype="text/plain")
+    return response
+
+@app.teardown_request
+def stop_profiler(error):
+    # after_request is skipped when handling fails; don't leave the sampling
+    # thread running in that case.
+    profiler = g.pop("profiler", None)
+    if profiler:
+        profiler.stop()
+
+@before_render_template.connect_via(app)
+def start_template_timer(sender, template, context, **extra):
+    g.template_start = time.perf_counter()
+
+@template_rendered.connect_via(app)
+def record_template(sender, template, context, **extra):
+    metrics.TEMPLATE_SECONDS.observe(time.perf_counter() - g.template_start, template.name)
 
 # ---------------- ROUTES ----------------
 
@@ -33,40 +156,40 @@ def index():
 
 @app.route("/create", methods=["POST"])
 def create_game():
-    game_code = generate_game_code()
-
-    games[game_code] = {
-        "players": {
-            "P1": {"name": session["player_name"], "secret": None},
-            "P2": {"name": None, "secret": None}
-        },
-        "turn": "P1",
-        "guesses": [],
-        "status": "waiting",  # waiting → secrets → playing → finished
-        "winner": None
-    }
+    game = Game(session["player_name"])
+    game_code = codes.add_game(game)
 
     session["game_code"] = game_code
+    session["game_nonce"] = game.nonce
     session["role"] = "P1"
 
     return redirect(url_for("wait", game_code=game_code))
 
+@app.route("/solo", methods=["POST"])
+def solo_game():
+    game = rules.new_solo_game(session["player_name"])
+    game_code = codes.add_game(game)
+
+    session["game_code"] = game_code
+    session["game_nonce"] = game.nonce
+    session["role"] = "P1"
+
+    return redirect(url_for("submit_secret", game_code=game_code))
+
 @app.route("/join", methods=["GET", "POST"])
 def join_game():
     if request.method == "POST":
         code = request.form["game_code"].upper()
+        name = session["player_name"]
 
-        if code not in games:
+        game, _, joined = update_game(code, lambda game: rules.join(game, name), None)
+        if game is None:
             return render_template("join_game.html", error="Invalid game code")
-
-        game = games[code]
-        if game["players"]["P2"]["name"]:
+        if not joined:
             return render_template("join_game.html", error="Game already full")
 
-        game["players"]["P2"]["name"] = session["player_name"]
-        game["status"] = "secrets"
-
         session["game_code"] = code
+        session["game_nonce"] = game.nonce
         session["role"] = "P2"
 
         return redirect(url_for("submit_secret", game_code=code))
@@ -75,75 +198,158 @@ def join_game():
 
 @app.route("/wait/<game_code>")
 def wait(game_code):
-    game = games[game_code]
-    if game["status"] == "secrets":
+    game, version = load_game(game_code)
+    if game.status == SECRETS:
         return redirect(url_for("submit_secret", game_code=game_code))
-    return render_template("wait.html", game_code=game_code)
+    return render_template(
+        "wait.html",
+        game_code=game_code,
+        version=version
+    )
 
 @app.route("/secret/<game_code>", methods=["GET", "POST"])
 def submit_secret(game_code):
-    game = games[game_code]
-    role = session["role"]
+    game, _ = load_game(game_code)
+    role = ROLE_INDEX[session["role"]]
+    error = None
 
-    if game["players"][role]["secret"]:
+    if game.secrets[role] is not None:
         return redirect(url_for("game", game_code=game_code))
 
     if request.method == "POST":
         secret = request.form["secret"]
-        game["players"][role]["secret"] = secret
 
-        if game["players"]["P1"]["secret"] and game["players"]["P2"]["secret"]:
-            game["status"] = "playing"
-            return redirect(url_for("game", game_code=game_code))
+        if not is_number(secret):
+            error = "Secret must be 4 digits"
+        else:
+            game, _, _ = update_game(
+                game_code, lambda game: rules.set_secret(game, role, secret),
+                session.get("game_nonce")
+            )
+            if game is None:
+                abort(404)
+            if game.status == PLAYING:
+                return redirect(url_for("game", game_code=game_code))
 
     return render_template(
         "submit_secret.html",
-        player=game["players"][role]["name"]
+        player=game.names[role],
+        error=error
     )
 
 @app.route("/game/<game_code>", methods=["GET", "POST"])
 def game(game_code):
-    game = games[game_code]
-    role = session["role"]
+    game, version = load_game(game_code)
+    role = ROLE_INDEX[session["role"]]
+    error = None
+    hint = None
 
-    if game["status"] == "finished":
+    if game.status == FINISHED:
         return redirect(url_for("winner", game_code=game_code))
 
-    if request.method == "POST" and game["turn"] == role:
+    if request.method == "POST" and "hint" in request.form:
+        hint = rules.hint(game, role)
+    elif request.method == "POST":
         guess = request.form["guess"]
-        opponent = "P2" if role == "P1" else "P1"
-        secret = game["players"][opponent]["secret"]
-
-        correct, position = evaluate_guess(secret, guess)
 
-        game["guesses"].append({
-            "player": game["players"][role]["name"],
-            "guess": guess,
-            "correct": correct,
-            "position": position
-        })
-
-        if position == 4:
-            game["status"] = "finished"
-            game["winner"] = game["players"][role]["name"]
+        if not is_number(guess):
+            error = "Guess must be 4 digits"
         else:
-            game["turn"] = opponent
+            game, version, _ = update_game(
+                game_code, lambda game: rules.play(game, role, guess),
+                session.get("game_nonce")
+            )
+            if game is None:
+                abort(404)
+            # The page would subscribe at the final version and never hear
+            # that the game is over.
+            if game.status == FINISHED:
+                return redirect(url_for("winner", game_code=game_code))
 
     return render_template(
         "game.html",
-        game=game,
-        role=role,
-        player_name=game["players"][role]["name"]
+        game_code=game_code,
+        turn_name=game.names[game.turn],
+        guesses=game.history(),
+        player_name=game.names[role],
+        version=version,
+        error=error,
+        hint=hint
     )
 
 @app.route("/winner/<game_code>")
 def winner(game_code):
-    game = games[game_code]
+    game, _ = load_game(game_code)
     return render_template(
         "winner.html",
-        winner=game["winner"],
-        secret1=game["players"]["P1"]["secret"],
-        secret2=game["players"]["P2"]["secret"]
+        winner=game.winner_name(),
+        secret1=game.secret(P1),
+        secret2=game.secret(P2)
+    )
+
+@app.route("/api/game/<game_code>/state")
+def game_state(game_code):
+    # `since` is how many guesses the client already has; only newer ones are
+    # sent. The body depends on nothing but the game version and `since`, so
+    # that pair is a strong ETag and unchanged games are answered with a 304
+    # from a single lookup. Clients of an earlier game under a recycled code
+    # hold a different nonce and get a 404 before the ETag is compared.
+    since = max(request.args.get("since", 0, type=int), 0)
+    version, nonce = store.head(game_code)
+    if not version or nonce != session.get("game_nonce"):
+        abort(404)
+    if request.if_none_match.contains(f"{version}-{since}"):
+        response = Response(status=304)
+        response.set_etag(f"{version}-{since}")
+        return response
+
+    game, version = store.get(game_code)
+    if game is None or game.nonce != session.get("game_nonce"):
+        abort(404)
+    response = jsonify(
+        version=version,
+        status=STATUSES[game.status],
+        turn_name=game.names[game.turn],
+        winner=game.winner_name(),
+        guesses=game.history(since),
+        next=max(len(game.guesses), since)
+    )
+    response.set_etag(f"{version}-{since}")
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+@app.route("/metrics")
+def prometheus_metrics():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+@app.errorhandler(CodesExhausted)
+def codes_exhausted(error):
+    return "All game codes are in use, try again later", 503
+
+@app.route("/events/<game_code>")
+def events(game_code):
+    version, nonce = store.head(game_code)
+    if not version or nonce != session.get("game_nonce"):
+        abort(404)
+    seen = request.args.get("v", version, type=int)
+
+    def stream():
+        nonlocal seen
+        while True:
+            version = wait_for_change(game_code, seen, KEEPALIVE_SECONDS)
+            if not version:
+                yield "data: 0\n\n"
+                return
+            if version != seen:
+                seen = version
+                yield f"data: {version}\n\n"
+            else:
+                yield ": keepalive\n\n"
+
+    return Response(
+        stream(),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
     )
 
 if __name__ == "__main__":
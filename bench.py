@@ -0,0 +1,357 @@
+import argparse
+import json
+import os
+import random
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import defaultdict
+from http.cookiejar import CookieJar
+
+from scoring import Candidates
+
+# Load generator for the full game flow. Simulates N pairs of bot players
+# going through / -> /create -> /join -> /secret -> /game -> /winner, polling
+# the state endpoint the way game.html does, and reports throughput, latency
+# percentiles per route and peak memory.
+#
+#   python bench.py --pairs 200 --think 0.1
+#   python bench.py --url http://127.0.0.1:5000 --pairs 50 --server-pid 1234
+#
+# Without --url the app is driven in-process through Flask's test client; set
+# GAME_STORE to compare backends. Memory is the resident set size (RSS) read
+# from /proc while the run lasts: of this process in-process, which includes
+# the bots, or of the --server-pid processes (give each worker) with --url.
+# The results name what was measured.
+#
+# A game that does not finish within --timeout seconds, or whose flow goes
+# wrong (a failed join, a game that disappears), is abandoned and counted
+# separately from completed games rather than stalling the run.
+
+
+class TestClientSession:
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, data=None, headers=None):
+        response = self.client.open(path, method=method, data=data, headers=headers)
+        return response.status_code, response.headers, response.data
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class HttpSession:
+    def __init__(self, url, timeout):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(CookieJar()), _NoRedirect
+        )
+
+    def request(self, method, path, data=None, headers=None):
+        body = urllib.parse.urlencode(data).encode() if data is not None else None
+        request = urllib.request.Request(
+            self.url + path, data=body, method=method, headers=headers or {}
+        )
+        try:
+            with self.opener.open(request, timeout=self.timeout) as response:
+                return response.status, response.headers, response.read()
+        except urllib.error.HTTPError as error:
+            return error.code, error.headers, error.read()
+
+
+class GameAbandoned(Exception):
+    pass
+
+
+class Stats:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.games = {"completed": 0, "abandoned": 0, "errored": 0}
+        self.failures = defaultdict(int)  # reason -> games
+        self.lock = threading.Lock()
+
+    def record(self, route, seconds, status):
+        with self.lock:
+            self.latencies[route].append(seconds)
+            if status >= 400:
+                self.errors[route] += 1
+
+    def record_game(self, error):
+        with self.lock:
+            if error is None:
+                self.games["completed"] += 1
+            elif isinstance(error, GameAbandoned):
+                self.games["abandoned"] += 1
+                self.failures[str(error)] += 1
+            else:
+                self.games["errored"] += 1
+                self.failures[f"{type(error).__name__}: {error}"] += 1
+
+
+def percentile(values, p):
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+class Bot:
+    def __init__(self, session, stats, name, think, poll, deadline, failed):
+        self.session = session
+        self.stats = stats
+        self.name = name
+        self.think = think
+        self.poll = poll
+        self.deadline = deadline  # time.monotonic() by which the game must end
+        self.failed = failed  # set when the partner gave up
+        self.code = None
+        self.since = 0
+        self.etag = None
+        self.state = None
+        self.candidates = Candidates()
+
+    def request(self, method, path, route, data=None, headers=None):
+        start = time.perf_counter()
+        status, headers, body = self.session.request(method, path, data, headers)
+        self.stats.record(f"{method} {route}", time.perf_counter() - start, status)
+        return status, headers, body
+
+    def pause(self, seconds):
+        if seconds:
+            time.sleep(random.uniform(0.5, 1.5) * seconds)
+
+    def sign_in(self):
+        self.request("GET", "/", "/")
+        self.request("POST", "/", "/", {"name": self.name})
+
+    def create(self):
+        status, headers, _ = self.request("POST", "/create", "/create")
+        if status != 302:
+            raise GameAbandoned(f"create answered {status}")
+        self.code = headers["Location"].rstrip("/").rsplit("/", 1)[-1]
+        self.request("GET", f"/wait/{self.code}", "/wait/<code>")
+
+    def join(self, code):
+        self.code = code
+        # A successful join redirects to the secret page; a failed one
+        # re-renders the form with an error.
+        status, _, _ = self.request("POST", "/join", "/join", {"game_code": code})
+        if status != 302:
+            raise GameAbandoned(f"join answered {status}")
+
+    def fetch_state(self):
+        headers = {"If-None-Match": self.etag} if self.etag else {}
+        status, headers, body = self.request(
+            "GET", f"/api/game/{self.code}/state?since={self.since}",
+            "/api/game/<code>/state", headers=headers
+        )
+        if status == 404:
+            raise GameAbandoned("game disappeared")
+        if status != 200:
+            return self.state
+        self.etag = headers.get("ETag")
+        self.state = json.loads(body)
+        for player, guess, correct, position in self.state["guesses"]:
+            if player == self.name:
+                self.candidates.narrow(int(guess), correct, position)
+        self.since = self.state["next"]
+        return self.state
+
+    def wait_for(self, ready):
+        while True:
+            state = self.fetch_state()
+            if state is not None and ready(state):
+                return
+            if self.failed.is_set():
+                raise GameAbandoned("partner gave up")
+            if time.monotonic() > self.deadline:
+                raise GameAbandoned("timed out")
+            time.sleep(self.poll)
+
+    def play(self):
+        self.request("GET", f"/secret/{self.code}", "/secret/<code>")
+        self.pause(self.think)
+        self.request(
+            "POST", f"/secret/{self.code}", "/secret/<code>",
+            {"secret": f"{random.randrange(10000):04d}"}
+        )
+        self.request("GET", f"/game/{self.code}", "/game/<code>")
+        while True:
+            self.wait_for(lambda state: state["status"] == "finished" or (
+                state["status"] == "playing" and state["turn_name"] == self.name
+            ))
+            if self.state["status"] == "finished":
+                break
+            self.pause(self.think)
+            self.request(
+                "POST", f"/game/{self.code}", "/game/<code>",
+                {"guess": f"{self.candidates.best_guess():04d}"}
+            )
+        self.request("GET", f"/winner/{self.code}", "/winner/<code>")
+
+
+def run_pair(index, new_session, stats, args):
+    deadline = time.monotonic() + args.timeout
+    failed = threading.Event()
+    host = Bot(new_session(), stats, f"bot-{index}-a", args.think, args.poll, deadline, failed)
+    guest = Bot(new_session(), stats, f"bot-{index}-b", args.think, args.poll, deadline, failed)
+    errors = []
+
+    def attempt(step):
+        try:
+            step()
+        except Exception as error:
+            errors.append(error)
+            failed.set()
+
+    def start():
+        host.sign_in()
+        guest.sign_in()
+        host.create()
+        guest.join(host.code)
+        host.wait_for(lambda state: state["status"] != "waiting")
+
+    attempt(start)
+    if not errors:
+        players = [threading.Thread(target=attempt, args=(bot.play,)) for bot in (host, guest)]
+        for player in players:
+            player.start()
+        for player in players:
+            player.join()
+    # The first error is the cause; the partner's is usually "partner gave up".
+    stats.record_game(errors[0] if errors else None)
+
+
+def rss_bytes(pids):
+    # Summed VmRSS of `pids`, or None where /proc is unavailable.
+    total = 0
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1]) * 1024
+        except OSError:
+            return None
+    return total
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the game flow")
+    parser.add_argument("--pairs", type=int, default=50, help="concurrent games")
+    parser.add_argument("--think", type=float, default=0.05,
+                        help="mean seconds a bot waits before each move")
+    parser.add_argument("--poll", type=float, default=0.05,
+                        help="seconds between state polls")
+    parser.add_argument("--timeout", type=float, default=120,
+                        help="seconds a game may take before it is abandoned")
+    parser.add_argument("--url", help="benchmark a running server instead")
+    parser.add_argument("--server-pid", type=int, action="append", default=[],
+                        help="with --url, a server process to measure (repeatable)")
+    parser.add_argument("--output", default="bench_results.json")
+    args = parser.parse_args(argv)
+
+    stats = Stats()
+    store = None
+    if args.url:
+        def new_session():
+            return HttpSession(args.url, args.timeout)
+    else:
+        import app
+        store = app.store
+
+        def new_session():
+            return TestClientSession(app.app)
+
+    if args.url:
+        pids = args.server_pid
+        measured = f"RSS of server processes {pids}"
+    else:
+        pids = [os.getpid()]
+        measured = "RSS of the benchmark process (app, test clients and bots)"
+    start_rss = rss_bytes(pids) if pids else None
+    if start_rss is None:
+        measured = "nothing (pass --server-pid on Linux to measure the server)"
+    peak = {"rss": start_rss, "games": None}
+    done = threading.Event()
+
+    def sample():
+        while not done.wait(0.1):
+            if start_rss is not None:
+                peak["rss"] = max(peak["rss"], rss_bytes(pids) or 0)
+            if store is not None:
+                counts, _ = store.stats()
+                peak["games"] = max(peak["games"] or 0, sum(counts.values()))
+
+    threading.Thread(target=sample, daemon=True).start()
+
+    start = time.perf_counter()
+    pairs = [
+        threading.Thread(target=run_pair, args=(i, new_session, stats, args))
+        for i in range(args.pairs)
+    ]
+    for pair in pairs:
+        pair.start()
+    for pair in pairs:
+        pair.join()
+    elapsed = time.perf_counter() - start
+    done.set()
+
+    completed = stats.games["completed"]
+    requests = sum(len(values) for values in stats.latencies.values())
+    routes = {}
+    for route, values in sorted(stats.latencies.items()):
+        values.sort()
+        routes[route] = {
+            "requests": len(values),
+            "errors": stats.errors[route],
+            "p50_ms": percentile(values, 50) * 1000,
+            "p95_ms": percentile(values, 95) * 1000,
+            "p99_ms": percentile(values, 99) * 1000,
+        }
+    results = {
+        "pairs": args.pairs,
+        "think_seconds": args.think,
+        "poll_seconds": args.poll,
+        "target": args.url or "test-client",
+        "elapsed_seconds": elapsed,
+        "games_completed": completed,
+        "games_abandoned": stats.games["abandoned"],
+        "games_errored": stats.games["errored"],
+        "failures": dict(stats.failures),
+        "requests": requests,
+        "requests_per_second": requests / elapsed,
+        "games_per_second": completed / elapsed,
+        "peak_live_games": peak["games"],
+        "memory": {
+            "measured": measured,
+            "start_rss_bytes": start_rss,
+            "peak_rss_bytes": peak["rss"],
+        },
+        "routes": routes,
+    }
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+
+    print(f"{completed} games, {requests} requests in {elapsed:.1f}s "
+          f"({results['requests_per_second']:.0f} req/s)")
+    if completed < args.pairs:
+        print(f"{stats.games['abandoned']} games abandoned, "
+              f"{stats.games['errored']} errored:")
+        for reason, count in sorted(stats.failures.items()):
+            print(f"  {count:>5}  {reason}")
+    print(f"{'route':32} {'count':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for route, row in routes.items():
+        print(f"{route:32} {row['requests']:>7} {row['p50_ms']:>8.2f} "
+              f"{row['p95_ms']:>8.2f} {row['p99_ms']:>8.2f}")
+    if start_rss is not None:
+        print(f"peak memory: {peak['rss'] / 2**20:.1f} MiB "
+              f"(from {start_rss / 2**20:.1f} MiB), {measured}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+import string
+
+# Game codes are 4 characters from A-Z0-9, i.e. 36^4 = 1296^2 possible codes.
+# Fresh codes come from walking a counter through a keyed permutation of that
+# space, so every code is handed out at most once and allocation never has to
+# retry, however full the space gets. Codes of evicted games go onto a FIFO
+# free list and are reused before the counter advances. Both the counter and
+# the free list live in the game store, so all workers share one pool.
+
+ALPHABET = string.ascii_uppercase + string.digits
+HALF = len(ALPHABET) ** 2
+CODE_SPACE = HALF * HALF
+ROUNDS = 4
+
+
+class CodesExhausted(Exception):
+    pass
+
+
+def _round(value, key, n):
+    return ((value + key + n) * 2654435761 >> 11) % HALF
+
+
+def permute(index, key):
+    # Feistel network over Z_1296 x Z_1296. Each round is invertible, so this
+    # is a bijection on exactly CODE_SPACE values with no cycle walking.
+    left, right = divmod(index, HALF)
+    for n in range(ROUNDS):
+        left, right = right, (left + _round(right, key, n)) % HALF
+    return left * HALF + right
+
+
+def encode(value):
+    chars = []
+    for _ in range(4):
+        value, digit = divmod(value, len(ALPHABET))
+        chars.append(ALPHABET[digit])
+    return "".join(reversed(chars))
+
+
+class CodeAllocator:
+    def __init__(self, store):
+        self.store = store
+        self.key = store.code_key()
+        store.on_evict(self.release)
+
+    def allocate(self):
+        code = self.store.pop_free_code()
+        if code is not None:
+            return code
+        index = self.store.next_code_index()
+        if index >= CODE_SPACE:
+            raise CodesExhausted("All game codes are in use")
+        return encode(permute(index, self.key))
+
+    def add_game(self, game):
+        code = self.allocate()
+        while not self.store.create(code, game):
+            code = self.allocate()
+        return code
+
+    def release(self, code):
+        self.store.push_free_code(code)
@@ -0,0 +1,244 @@
+import atexit
+import fcntl
+import json
+import os
+import sys
+import threading
+
+from models import FINISHED, P1, P2, PLAYING, SECRETS, unpack_guess
+
+# Append-only event log that makes the memory store survive restarts. Every
+# store operation is one JSON line in events-<segment>.log:
+#
+#   ["k", key]              code permutation key, first line of a fresh log
+#   ["c", code, record]     game created
+#   ["u", code, [event..]]  one compare_and_set, made of:
+#                             ["j", name]          P2 joined
+#                             ["s", role, secret]  secret submitted
+#                             ["g", packed]        guess appended with its score
+#                             ["f", winner]        game finished
+#   ["x", code]             game evicted
+#   ["n"], ["p"], ["r", code]  code counter advanced, free code taken, code freed
+#
+# Appends only touch an in-memory buffer. A background thread writes and
+# fsyncs it every GAME_LOG_FLUSH_SECONDS, so a crash loses at most that much
+# and requests never wait on the disk. Every GAME_SNAPSHOT_EVERY events the
+# store writes snapshot.json from a separate thread, so flushing carries on
+# meanwhile, and older segments are deleted, which bounds how much has to be
+# replayed on startup.
+#
+# The log belongs to a single process, like the memory store it records: two
+# writers would interleave their segments and delete each other's. recover()
+# takes an exclusive lock on the directory and fails if it is already held.
+
+FLUSH_SECONDS = float(os.environ.get("GAME_LOG_FLUSH_SECONDS", 0.05))
+SNAPSHOT_EVERY = int(os.environ.get("GAME_SNAPSHOT_EVERY", 200000))
+
+
+def _dumps(value):
+    return json.dumps(value, separators=(",", ":"))
+
+
+def _load_lines(data):
+    # json.dumps escapes newlines inside strings, so the lines can be joined
+    # into one JSON array and decoded in a single call, which is several
+    # times faster than decoding line by line.
+    if not data:
+        return []
+    return json.loads(b"[" + data.rstrip(b"\n").replace(b"\n", b",") + b"]")
+
+
+def _offload(function, *args):
+    # Under gevent (gunicorn.conf.py's worker class) all greenlets of a worker
+    # share one OS thread, so writes and fsyncs go to gevent's pool of native
+    # threads instead of stalling every request while they run.
+    monkey = sys.modules.get("gevent.monkey")
+    if monkey is not None and monkey.is_module_patched("threading"):
+        from gevent import get_hub
+        return get_hub().threadpool.apply(function, args)
+    return function(*args)
+
+
+def update_events(old, new):
+    events = []
+    if old.names[P2] != new.names[P2]:
+        events.append(["j", new.names[P2]])
+    for role, secret in enumerate(new.secrets):
+        if old.secrets[role] != secret:
+            events.append(["s", role, secret])
+    for packed in new.guesses[len(old.guesses):]:
+        events.append(["g", packed])
+    if new.status == FINISHED and old.status != FINISHED:
+        events.append(["f", new.winner])
+    return events
+
+
+def apply_events(game, events):
+    for event in events:
+        kind = event[0]
+        if kind == "j":
+            game.names[P2] = event[1]
+            game.status = SECRETS
+        elif kind == "s":
+            game.secrets[event[1]] = event[2]
+            if None not in game.secrets:
+                game.status = PLAYING
+        elif kind == "g":
+            game.guesses.append(event[1])
+            game.turn = P2 if unpack_guess(event[1])[0] == P1 else P1
+        elif kind == "f":
+            game.status = FINISHED
+            game.winner = game.turn = event[1]
+
+
+class EventLog:
+    def __init__(self, directory, flush_seconds=FLUSH_SECONDS, snapshot_every=SNAPSHOT_EVERY):
+        self.directory = directory
+        self.flush_seconds = flush_seconds
+        self.snapshot_every = snapshot_every
+        self.on_snapshot = None
+        self.segment = 0
+        self._buffer = []
+        self._rotated = []  # (segment, lines) closed by rotate(), not yet written
+        self._since_snapshot = 0
+        self._snapshotting = False
+        self._file = None
+        self._lock_file = None  # held open while this process owns the log
+        self._lock = threading.Lock()  # guards the buffers and segment number
+        self._write_lock = threading.Lock()  # guards the file
+        self._closed = threading.Event()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _segment_path(self, segment):
+        return self._path(f"events-{segment:08d}.log")
+
+    def _segments(self):
+        return sorted(
+            int(name[7:-4]) for name in os.listdir(self.directory)
+            if name.startswith("events-") and name.endswith(".log")
+        )
+
+    def recover(self):
+        # Returns (snapshot header or None, snapshot games, events to replay)
+        # and opens the newest segment for appending.
+        self._lock_file = open(self._path("lock"), "w")
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise RuntimeError(
+                f"{self.directory} is in use by another process; the event log "
+                "supports a single process only"
+            ) from None
+
+        header, games = None, []
+        if os.path.exists(self._path("snapshot.json")):
+            with open(self._path("snapshot.json"), "rb") as f:
+                header = json.loads(f.readline())
+                games = _load_lines(f.read())
+
+        first = header["segment"] if header else 0
+        segments = [segment for segment in self._segments() if segment >= first]
+        events = []
+        for segment in segments:
+            with open(self._segment_path(segment), "rb+") as f:
+                data = f.read()
+                # Anything after the last newline was cut off by a crash.
+                valid = data.rfind(b"\n") + 1
+                f.truncate(valid)
+            events.extend(_load_lines(data[:valid]))
+
+        self.segment = segments[-1] if segments else first
+        self._file = open(self._segment_path(self.segment), "a")
+        threading.Thread(target=self._run, daemon=True).start()
+        atexit.register(self.close)
+        return header, games, events
+
+    def append(self, event):
+        with self._lock:
+            self._buffer.append(_dumps(event) + "\n")
+            self._since_snapshot += 1
+
+    def flush(self):
+        with self._write_lock:
+            with self._lock:
+                rotated, self._rotated = self._rotated, []
+                buffer, self._buffer = self._buffer, []
+            if self._file is not None:
+                _offload(self._write_all, rotated, buffer)
+
+    def _write_all(self, rotated, buffer):
+        # The open file always belongs to the oldest segment not yet
+        # finished, so each rotated batch completes it and moves on.
+        for segment, lines in rotated:
+            self._write(lines)
+            self._file.close()
+            self._file = open(self._segment_path(segment + 1), "a")
+        self._write(buffer)
+
+    def _write(self, lines):
+        if lines:
+            self._file.write("".join(lines))
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def _run(self):
+        while not self._closed.wait(self.flush_seconds):
+            self.flush()
+            if (self.on_snapshot and not self._snapshotting
+                    and self._since_snapshot >= self.snapshot_every):
+                self._since_snapshot = 0
+                self._snapshotting = True
+                threading.Thread(target=self._snapshot, daemon=True).start()
+
+    def _snapshot(self):
+        try:
+            self.on_snapshot()
+        finally:
+            self._snapshotting = False
+
+    def rotate(self):
+        # Called with the store locked, so no events arrive in between: all
+        # earlier events end up in old segments and the caller's copy of the
+        # state matches the start of the new one. Only the buffer is swapped
+        # here; the flusher writes and fsyncs the old segment later.
+        with self._lock:
+            self._rotated.append((self.segment, self._buffer))
+            self._buffer = []
+            self.segment += 1
+            return self.segment
+
+    def write_snapshot(self, header, games):
+        # Finish the segments being replaced first, so none of them is
+        # written again after it has been deleted below.
+        self.flush()
+        _offload(self._write_snapshot, header, games)
+
+    def _write_snapshot(self, header, games):
+        path = self._path("snapshot.json")
+        with open(path + ".tmp", "w") as f:
+            f.write(_dumps(header) + "\n")
+            for code, (version, game) in games:
+                f.write(_dumps([code, version, game.to_record()]) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + ".tmp", path)
+        directory = os.open(self.directory, os.O_RDONLY)
+        try:
+            os.fsync(directory)
+        finally:
+            os.close(directory)
+        for segment in self._segments():
+            if segment < header["segment"]:
+                os.remove(self._segment_path(segment))
+
+    def close(self):
+        if not self._closed.is_set():
+            self._closed.set()
+            self.flush()
+            with self._write_lock:
+                self._file.close()
+                self._file = None
+            self._lock_file.close()
@@ -0,0 +1,42 @@
+import os
+import tempfile
+
+# Every open wait or game page keeps an /events stream open until the game
+# changes. gevent workers park each stream as a greenlet, so an idle game
+# costs a few kilobytes rather than a request thread, and ordinary requests
+# are never queued behind open streams.
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+worker_class = "gevent"
+worker_connections = int(os.environ.get("GUNICORN_CONNECTIONS", 10000))
+# Streams send a keepalive every 15s, well inside this.
+timeout = 60
+
+# The sampling profiler reads the stack of the thread serving a request,
+# which needs a real thread per request.
+if os.environ.get("PROFILE_REQUESTS") == "1":
+    worker_class = "gthread"
+    threads = 50
+
+# The memory store, and the event log behind it, only exist inside one
+# process: a second worker would not see its games. Several workers are only
+# possible with the shared SQLite store.
+shared_store = os.environ.get("GAME_STORE", "memory").startswith("sqlite:///")
+workers = int(os.environ.get("WEB_CONCURRENCY", 2 if shared_store else 1))
+if workers > 1 and not shared_store:
+    raise SystemExit(
+        f"WEB_CONCURRENCY={workers} needs GAME_STORE=sqlite:///...; "
+        "the memory store is per process"
+    )
+
+# Each worker counts its own requests; with several workers they share their
+# metrics through files so that /metrics on any of them reports the total.
+if workers > 1 and "METRICS_DIR" not in os.environ:
+    os.environ["METRICS_DIR"] = tempfile.mkdtemp(prefix="game-metrics-")
+
+
+def on_starting(server):
+    # Counters restart with the server; drop files left by an earlier run.
+    directory = os.environ.get("METRICS_DIR")
+    if directory and os.path.isdir(directory):
+        for name in os.listdir(directory):
+            os.remove(os.path.join(directory, name))
@@ -0,0 +1,233 @@
+import json
+import os
+import sys
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter as Tally
+
+from models import STATUSES
+
+# Minimal Prometheus instrumentation: counters, histograms and store gauges
+# read at scrape time, rendered in the text exposition format by render().
+# Recording is a dict update under a lock, cheap enough for every request and
+# every guess.
+#
+# Counters and histograms live in each process. When several workers serve
+# the app, set METRICS_DIR (gunicorn.conf.py does): every process then writes
+# its values to METRICS_DIR/<pid>.json every DUMP_SECONDS, and render() sums
+# the files of all workers, so any worker can answer a scrape for all of them.
+# Files of exited workers are kept, so counters never go backwards.
+
+REGISTRY = []
+
+METRICS_DIR = os.environ.get("METRICS_DIR")
+DUMP_SECONDS = 1
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def render(self, shards):
+        values = self.values()
+        for shard in shards:
+            for labels, value in shard.get(self.name, ()):
+                labels = tuple(labels)
+                values[labels] = self.merge(values[labels], value) if labels in values else value
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} {self.kind}"
+        yield from self.samples(sorted(values.items()))
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name, help, labels=()):
+        super().__init__(name, help, labels)
+        self._values = {}
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def values(self):
+        with self._lock:
+            return dict(self._values)
+
+    @staticmethod
+    def merge(value, other):
+        return value + other
+
+    def samples(self, values):
+        for labels, value in values:
+            yield f"{self.name}{_labels(self.labels, labels)} {value}"
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = buckets
+        self._values = {}
+
+    def observe(self, value, *labels):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def values(self):
+        with self._lock:
+            return {labels: [counts[:], total] for labels, (counts, total) in self._values.items()}
+
+    @staticmethod
+    def merge(value, other):
+        return [[a + b for a, b in zip(value[0], other[0])], value[1] + other[1]]
+
+    def samples(self, values):
+        for labels, (counts, total) in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                le = _labels(self.labels, labels, [("le", bound)])
+                yield f"{self.name}_bucket{le} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labels, labels)} {total}"
+            yield f"{self.name}_count{_labels(self.labels, labels)} {cumulative}"
+
+
+class StoreCollector:
+    # Gauges describing the store's contents. stats() can scan the whole
+    # store, so it is called once per scrape and both gauges come from it.
+
+    def __init__(self, store):
+        self.store = store
+        REGISTRY.append(self)
+
+    def render(self, shards):
+        # The store is shared between workers or there is only one, so this
+        # process's view is already the whole picture.
+        counts, guesses = self.store.stats()
+        yield "# HELP game_live_games Games held in the store"
+        yield "# TYPE game_live_games gauge"
+        for index, status in enumerate(STATUSES):
+            yield f"game_live_games{_labels(('status',), (status,))} {counts.get(index, 0)}"
+        yield "# HELP game_guesses_held Guesses held in the store"
+        yield "# TYPE game_guesses_held gauge"
+        yield f"game_guesses_held {guesses}"
+
+
+def dump():
+    shard = {
+        metric.name: [[list(labels), value] for labels, value in metric.values().items()]
+        for metric in REGISTRY if isinstance(metric, Metric)
+    }
+    path = os.path.join(METRICS_DIR, f"{os.getpid()}.json")
+    with open(path + ".tmp", "w") as f:
+        json.dump(shard, f)
+    os.replace(path + ".tmp", path)
+
+
+def _dump_forever():
+    while True:
+        time.sleep(DUMP_SECONDS)
+        dump()
+
+
+def _other_shards():
+    shards = []
+    own = f"{os.getpid()}.json"
+    for name in os.listdir(METRICS_DIR):
+        if name.endswith(".json") and name != own:
+            try:
+                with open(os.path.join(METRICS_DIR, name)) as f:
+                    shards.append(json.load(f))
+            except (OSError, ValueError):
+                pass  # replaced or removed while we read it
+    return shards
+
+
+def render():
+    shards = _other_shards() if METRICS_DIR else []
+    return "\n".join(line for metric in REGISTRY for line in metric.render(shards)) + "\n"
+
+
+REQUESTS = Counter(
+    "game_http_requests_total", "HTTP requests handled", ("route", "method", "status")
+)
+REQUEST_SECONDS = Histogram(
+    "game_http_request_seconds", "Time spent in views, including rendering", ("route",)
+)
+TEMPLATE_SECONDS = Histogram(
+    "game_template_render_seconds", "Time spent rendering templates", ("template",)
+)
+GUESSES = Counter("game_guesses_total", "Guesses scored")
+SCORING_SECONDS = Histogram(
+    "game_scoring_seconds", "Time spent in evaluate_guess",
+    buckets=(0.000001, 0.0000025, 0.000005, 0.00001, 0.000025, 0.00005, 0.0001),
+)
+
+
+def register_store(store):
+    StoreCollector(store)
+
+
+if METRICS_DIR:
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    threading.Thread(target=_dump_forever, daemon=True).start()
+
+
+class SamplingProfiler:
+    # Samples one thread's stack every `interval` seconds from a background
+    # thread and reports the collected stacks in the collapsed format used by
+    # flamegraph tools ("outer;inner;leaf count"), hottest first.
+
+    def __init__(self, thread_id, interval=0.001):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Tally()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({code.co_filename}:{frame.f_lineno})")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+        return "\n".join(f"{stack} {count}" for stack, count in self.stacks.most_common()) + "\n"
@@ -0,0 +1,98 @@
+import random
+from array import array
+from collections import namedtuple
+
+# Compact game record. Roles, turn, status and winner are small ints, secrets
+# are 4-digit numbers and every guess is packed into a single unsigned int:
+#
+#   bits 0-13  guessed number (0-9999)
+#   bits 14-16 correct digits (0-4)
+#   bits 17-19 correct positions (0-4)
+#   bit  20    player who guessed (P1=0, P2=1)
+
+P1, P2 = 0, 1
+ROLES = ("P1", "P2")
+
+WAITING, SECRETS, PLAYING, FINISHED = range(4)
+STATUSES = ("waiting", "secrets", "playing", "finished")
+
+Guess = namedtuple("Guess", "player guess correct position")
+
+
+def is_number(value):
+    return len(value) == 4 and value.isascii() and value.isdigit()
+
+
+def pack_guess(player, number, correct, position):
+    return number | correct << 14 | position << 17 | player << 20
+
+
+def unpack_guess(packed):
+    return packed >> 20, packed & 0x3FFF, packed >> 14 & 7, packed >> 17 & 7
+
+
+class Game:
+    __slots__ = ("names", "secrets", "turn", "status", "winner", "guesses", "bot", "nonce")
+
+    def __init__(self, p1_name, bot=False):
+        self.names = [p1_name, None]
+        self.secrets = [None, None]
+        self.turn = P1
+        self.status = WAITING  # waiting → secrets → playing → finished
+        self.winner = None
+        self.guesses = array("I")
+        self.bot = bot  # P2 is played by the computer
+        # Codes are recycled, so players also hold this random nonce to prove
+        # they belong to this game and not an earlier one with the same code.
+        self.nonce = random.getrandbits(48)
+
+    def copy(self):
+        game = Game.__new__(Game)
+        game.names = self.names[:]
+        game.secrets = self.secrets[:]
+        game.turn = self.turn
+        game.status = self.status
+        game.winner = self.winner
+        game.guesses = array("I", self.guesses)
+        game.bot = self.bot
+        game.nonce = self.nonce
+        return game
+
+    def secret(self, role):
+        number = self.secrets[role]
+        return None if number is None else f"{number:04d}"
+
+    def winner_name(self):
+        return None if self.winner is None else self.names[self.winner]
+
+    def add_guess(self, role, guess, correct, position):
+        self.guesses.append(pack_guess(role, int(guess), correct, position))
+
+    def guesses_by(self, role):
+        return [
+            (number, correct, position)
+            for player, number, correct, position in map(unpack_guess, self.guesses)
+            if player == role
+        ]
+
+    def history(self, since=0):
+        return [
+            Guess(self.names[player], f"{number:04d}", correct, position)
+            for player, number, correct, position in map(unpack_guess, self.guesses[since:])
+        ]
+
+    def to_record(self):
+        return [
+            self.names, self.secrets, self.turn, self.status, self.winner,
+            self.guesses.tolist(), self.bot, self.nonce
+        ]
+
+    @classmethod
+    def from_record(cls, record):
+        game = cls.__new__(cls)
+        (names, secrets, game.turn, game.status, game.winner, guesses, game.bot,
+         game.nonce) = record
+        game.names = names
+        game.secrets = secrets
+        game.guesses = array("I", guesses)
+        return game
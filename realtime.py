@@ -0,0 +1,295 @@
+import asyncio
+import json
+
+import metrics
+import rules
+from codes import CodeAllocator, CodesExhausted
+from models import FINISHED, P1, P2, ROLES, STATUSES, Game, is_number
+from store import open_store
+
+# Async serving mode: a plain ASGI app that plays the same create / join /
+# secret / guess flow as the Flask routes, over one WebSocket per player.
+# Run it with `uvicorn realtime:app`. An idle player is just a suspended
+# coroutine, so one process can hold tens of thousands of them, and every
+# move is pushed to both players from the event-loop tick that applied it.
+# Store calls and bot/hint searches can block (SQLite, minimax), so they run
+# in worker threads and the loop only moves messages.
+#
+# Clients send JSON messages with an "action" and get back "joined",
+# "state", "hint", "error" and "expired" messages:
+#
+#   {"action": "create", "name": "Ann"}
+#   {"action": "solo", "name": "Ann"}
+#   {"action": "join", "name": "Bob", "code": "K3ZQ"}
+#   {"action": "resume", "code": "K3ZQ", "nonce": 81234567, "role": "P2"}
+#   {"action": "secret", "secret": "1234"}
+#   {"action": "guess", "guess": "5678"}
+#   {"action": "hint"}
+#
+# "joined" carries the game's nonce; a client whose socket dropped reconnects
+# and sends it back with "resume", as the Flask pages do with their session
+# cookie. "state" includes both secrets once the game is finished.
+
+store = open_store()
+codes = CodeAllocator(store)
+metrics.register_store(store)
+
+rooms = {}
+loop = None  # the serving event loop, set on the first connection
+
+
+class Player:
+    def __init__(self, send):
+        self.send = send
+        self.code = None
+        self.role = None
+        self.nonce = None  # tells this game apart from others with its code
+        self.since = 0  # guesses already sent to this player
+
+    async def message(self, **message):
+        await self.send({"type": "websocket.send", "text": json.dumps(message)})
+
+
+def enter_room(player, code, role, nonce):
+    player.code = code
+    player.role = role
+    player.nonce = nonce
+    player.since = 0
+    rooms.setdefault(code, set()).add(player)
+
+
+def leave_room(player):
+    room = rooms.get(player.code)
+    if room is not None:
+        room.discard(player)
+        if not room:
+            del rooms[player.code]
+
+
+@store.on_evict
+def close_room(code):
+    # Evictions can be raised from any thread that writes to the store, so
+    # the room is closed on the event loop that owns its players.
+    if loop is None:
+        rooms.pop(code, None)
+    else:
+        loop.call_soon_threadsafe(_close_room, code)
+
+
+def _close_room(code):
+    players = rooms.pop(code, ())
+    for player in players:
+        player.code = player.role = player.nonce = None
+        asyncio.ensure_future(_notify_expired(player))
+
+
+async def _notify_expired(player):
+    try:
+        await player.message(type="expired")
+    except Exception:
+        pass  # already disconnected
+
+
+async def send_state(player, game, version):
+    guesses = game.history(player.since)
+    player.since = len(game.guesses)
+    await player.message(
+        type="state",
+        code=player.code,
+        version=version,
+        status=STATUSES[game.status],
+        turn=ROLES[game.turn],
+        turn_name=game.names[game.turn],
+        winner=game.winner_name(),
+        guesses=guesses,
+        secrets=[game.secret(P1), game.secret(P2)] if game.status == FINISHED else None,
+    )
+
+
+async def broadcast(code):
+    game, version = await asyncio.to_thread(store.get, code)
+    if game is None:
+        return
+    # A player who just disconnected must not stop the other from hearing
+    # about the move.
+    await asyncio.gather(
+        *(send_state(player, game, version) for player in rooms.get(code, ())),
+        return_exceptions=True,
+    )
+
+
+async def apply(player, change):
+    # The room can be closed while the update runs, so work from a copy of
+    # the player's game rather than its live attributes.
+    code, role, nonce = player.code, player.role, player.nonce
+    if code is None:
+        return await player.message(type="error", message="Not in a game")
+    game, version, changed = await asyncio.to_thread(
+        store.update, code, lambda game: change(game, role), nonce
+    )
+    if game is None:
+        return await player.message(type="error", message="Game has expired")
+    if changed:
+        await broadcast(code)
+    else:
+        # Out of turn or repeated; answer with the unchanged state.
+        await send_state(player, game, version)
+
+
+# ---------------- ACTIONS ----------------
+
+class BadRequest(Exception):
+    pass
+
+
+def field(message, name):
+    value = message.get(name)
+    if not isinstance(value, str):
+        raise BadRequest
+    return value
+
+
+async def create(player, message):
+    await start(player, Game(field(message, "name")))
+
+
+async def solo(player, message):
+    await start(player, rules.new_solo_game(field(message, "name")))
+
+
+async def start(player, game):
+    code = await asyncio.to_thread(codes.add_game, game)
+    leave_room(player)
+    enter_room(player, code, P1, game.nonce)
+    await player.message(type="joined", code=code, role=ROLES[P1], nonce=game.nonce)
+    await broadcast(code)
+
+
+async def join(player, message):
+    code = field(message, "code").upper()
+    name = field(message, "name")
+    game, _, joined = await asyncio.to_thread(
+        store.update, code, lambda game: rules.join(game, name)
+    )
+    if game is None:
+        return await player.message(type="error", message="Invalid game code")
+    if not joined:
+        return await player.message(type="error", message="Game already full")
+    leave_room(player)
+    enter_room(player, code, P2, game.nonce)
+    await player.message(type="joined", code=code, role=ROLES[P2], nonce=game.nonce)
+    await broadcast(code)
+
+
+async def resume(player, message):
+    code = field(message, "code").upper()
+    role = field(message, "role")
+    nonce = message.get("nonce")
+    if role not in ROLES or not isinstance(nonce, int):
+        raise BadRequest
+    game, version = await asyncio.to_thread(store.get, code)
+    if game is None or game.nonce != nonce:
+        return await player.message(type="error", message="Game has expired")
+    leave_room(player)
+    enter_room(player, code, ROLES.index(role), nonce)
+    await player.message(type="joined", code=code, role=role, nonce=nonce)
+    await send_state(player, game, version)
+
+
+async def secret(player, message):
+    value = field(message, "secret")
+    if not is_number(value):
+        return await player.message(type="error", message="Secret must be 4 digits")
+    await apply(player, lambda game, role: rules.set_secret(game, role, value))
+
+
+async def guess(player, message):
+    value = field(message, "guess")
+    if not is_number(value):
+        return await player.message(type="error", message="Guess must be 4 digits")
+    await apply(player, lambda game, role: rules.play(game, role, value))
+
+
+async def hint(player, message):
+    code, role, nonce = player.code, player.role, player.nonce
+    if code is None:
+        return await player.message(type="error", message="Not in a game")
+    game, _ = await asyncio.to_thread(store.get, code)
+    if game is None or game.nonce != nonce:
+        return await player.message(type="error", message="Game has expired")
+    await player.message(type="hint", hint=await asyncio.to_thread(rules.hint, game, role))
+
+
+ACTIONS = {
+    "create": create,
+    "solo": solo,
+    "join": join,
+    "resume": resume,
+    "secret": secret,
+    "guess": guess,
+    "hint": hint,
+}
+
+# ---------------- ASGI ----------------
+
+async def handle(player, text):
+    # Only malformed input is answered as a bad request; anything else raised
+    # by an action is a bug and propagates so the server logs it.
+    try:
+        message = json.loads(text)
+        action = ACTIONS[message["action"]]
+    except (ValueError, KeyError, TypeError):
+        return await player.message(type="error", message="Bad request")
+    try:
+        await action(player, message)
+    except BadRequest:
+        await player.message(type="error", message="Bad request")
+    except CodesExhausted:
+        await player.message(type="error", message="All game codes are in use")
+
+
+async def lifespan(receive, send):
+    while True:
+        event = await receive()
+        if event["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif event["type"] == "lifespan.shutdown":
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    global loop
+    loop = asyncio.get_running_loop()
+    if scope["type"] == "lifespan":
+        return await lifespan(receive, send)
+    if scope["type"] == "http" and scope["path"] == "/metrics":
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [(b"content-type", b"text/plain; version=0.0.4")],
+        })
+        return await send({"type": "http.response.body", "body": metrics.render().encode()})
+    if scope["type"] != "websocket":
+        await send({
+            "type": "http.response.start",
+            "status": 426,
+            "headers": [(b"content-type", b"text/plain")],
+        })
+        return await send({"type": "http.response.body", "body": b"WebSocket only"})
+
+    event = await receive()
+    if event["type"] != "websocket.connect":
+        return
+    await send({"type": "websocket.accept"})
+
+    player = Player(send)
+    try:
+        while True:
+            event = await receive()
+            if event["type"] == "websocket.disconnect":
+                break
+            if event.get("text") is not None:
+                await handle(player, event["text"])
+    finally:
+        leave_room(player)
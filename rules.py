@@ -0,0 +1,80 @@
+import random
+import time
+
+import metrics
+from models import FINISHED, P1, P2, PLAYING, SECRETS, Game
+from scoring import Candidates
+
+# Game rules shared by the Flask routes in app.py and the WebSocket server in
+# realtime.py. Every `change` function mutates a game in place and returns
+# whether it changed anything, which is the shape update_game() expects.
+
+
+def evaluate_guess(secret, guess):
+    correct_position = sum(s == g for s, g in zip(secret, guess))
+    correct_digits = sum(min(secret.count(d), guess.count(d)) for d in set(guess))
+    return correct_digits, correct_position
+
+
+def opponent_of(role):
+    return P2 if role == P1 else P1
+
+
+def new_solo_game(name):
+    game = Game(name, bot=True)
+    game.names[P2] = "Computer"
+    game.secrets[P2] = random.randrange(10000)
+    game.status = SECRETS
+    return game
+
+
+def join(game, name):
+    if game.names[P2]:
+        return False
+    game.names[P2] = name
+    game.status = SECRETS
+    return True
+
+
+def set_secret(game, role, secret):
+    if game.secrets[role] is not None:
+        return False
+    game.secrets[role] = int(secret)
+    if None not in game.secrets:
+        game.status = PLAYING
+    return True
+
+
+def record_guess(game, role, guess):
+    opponent = opponent_of(role)
+    start = time.perf_counter()
+    correct, position = evaluate_guess(game.secret(opponent), guess)
+    metrics.SCORING_SECONDS.observe(time.perf_counter() - start)
+    metrics.GUESSES.inc()
+
+    game.add_guess(role, guess, correct, position)
+
+    if position == 4:
+        game.status = FINISHED
+        game.winner = role
+    else:
+        game.turn = opponent
+
+
+def bot_guess(game):
+    candidates = Candidates.from_guesses(game.guesses_by(P2))
+    record_guess(game, P2, f"{candidates.best_guess():04d}")
+
+
+def play(game, role, guess):
+    if game.status != PLAYING or game.turn != role:
+        return False
+    record_guess(game, role, guess)
+    if game.bot and game.status == PLAYING:
+        bot_guess(game)
+    return True
+
+
+def hint(game, role):
+    candidates = Candidates.from_guesses(game.guesses_by(role))
+    return f"{len(candidates)} possible secrets left, try {candidates.best_guess():04d}"
@@ -0,0 +1,59 @@
+import random
+
+import numpy as np
+
+# Batched version of rules.evaluate_guess over every 4-digit number at once.
+# Each number 0000-9999 is precomputed as its digits and as a count of each
+# digit 0-9, so scoring one guess against any set of candidates is a couple
+# of vectorized comparisons instead of a Python loop per candidate.
+
+NUMBERS = np.arange(10000)
+DIGITS = ((NUMBERS[:, None] // np.array([1000, 100, 10, 1])) % 10).astype(np.int8)
+COUNTS = np.stack([(DIGITS == d).sum(axis=1) for d in range(10)], axis=1).astype(np.int8)
+
+# Above this many candidates best_guess picks at random instead of running the
+# quadratic minimax search.
+MINIMAX_LIMIT = 300
+
+
+def score(guess, candidates=NUMBERS):
+    if candidates is NUMBERS:
+        digits, counts = DIGITS, COUNTS
+    else:
+        digits, counts = DIGITS[candidates], COUNTS[candidates]
+    correct_position = (digits == DIGITS[guess]).sum(axis=1, dtype=np.int8)
+    correct_digits = np.minimum(counts, COUNTS[guess]).sum(axis=1, dtype=np.int8)
+    return correct_digits, correct_position
+
+
+class Candidates:
+    def __init__(self, remaining=NUMBERS):
+        self.remaining = remaining
+
+    @classmethod
+    def from_guesses(cls, guesses):
+        candidates = cls()
+        for guess, correct, position in guesses:
+            candidates.narrow(guess, correct, position)
+        return candidates
+
+    def __len__(self):
+        return len(self.remaining)
+
+    def narrow(self, guess, correct, position):
+        correct_digits, correct_position = score(guess, self.remaining)
+        keep = (correct_digits == correct) & (correct_position == position)
+        self.remaining = self.remaining[keep]
+
+    def best_guess(self, rng=random):
+        if len(self.remaining) > MINIMAX_LIMIT:
+            return int(rng.choice(self.remaining))
+        # Pick the candidate whose worst-case answer leaves the fewest
+        # candidates behind.
+        best, best_worst = None, None
+        for guess in self.remaining:
+            correct_digits, correct_position = score(guess, self.remaining)
+            worst = np.bincount(correct_digits * 5 + correct_position).max()
+            if best_worst is None or worst < best_worst:
+                best, best_worst = guess, worst
+        return int(best)
@@ -1,4 +1,6 @@
 #!/usr/bin/env bash
-export FLASK_APP=app.py
-export FLASK_ENV=production
-flask run --host=0.0.0.0 --port=$PORT
+if [ "$SERVER_MODE" = "async" ]; then
+    exec uvicorn realtime:app --host 0.0.0.0 --port $PORT
+fi
+# gunicorn.conf.py picks threaded workers, which the /events streams need.
+exec gunicorn app:app
@@ -0,0 +1,462 @@
+import gc
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
+
+from eventlog import EventLog, apply_events, update_events
+from models import FINISHED, STATUSES, Game
+
+# Games are read as (game, version) pairs and written back with
+# compare_and_set, which only succeeds if nobody else wrote the game in the
+# meantime. Callers retry on conflict, so turn changes stay atomic even when
+# several workers share one store.
+#
+# Games also expire: finished games after FINISHED_GRACE_SECONDS, anything
+# still waiting, choosing secrets or being played after GAME_TTL_SECONDS
+# without activity. Each store evicts a bounded number of expired games as a
+# side effect of writes, so there is never a full scan of live games.
+#
+# Stores also hold the game-code pool used by codes.CodeAllocator: a
+# permutation key, a counter into the code space and a free list of codes
+# released by evicted games.
+#
+# The memory store can be made durable with GAME_LOG_DIR: every operation is
+# then appended to an eventlog.EventLog and replayed from it on startup. The
+# memory store and its log live in one process, so serving from several
+# workers requires the SQLite store.
+
+GAME_TTL_SECONDS = int(os.environ.get("GAME_TTL_SECONDS", 3600))
+FINISHED_GRACE_SECONDS = int(os.environ.get("FINISHED_GRACE_SECONDS", 300))
+
+
+class GameStore(ABC):
+    # True when other processes can write to the store, so waiters cannot
+    # rely on in-process notifications alone.
+    shared = False
+
+    def __init__(self, ttl=GAME_TTL_SECONDS, finished_grace=FINISHED_GRACE_SECONDS):
+        self.ttl = ttl
+        self.finished_grace = finished_grace
+        self.evict_callbacks = []
+
+    def on_evict(self, callback):
+        self.evict_callbacks.append(callback)
+        return callback
+
+    def _evicted(self, codes):
+        for code in codes:
+            for callback in self.evict_callbacks:
+                callback(code)
+
+    def _expires_at(self, game, now):
+        return now + (self.finished_grace if game.status == FINISHED else self.ttl)
+
+    def update(self, code, change, nonce=None):
+        # Re-read and retry until our write wins, so two players acting at
+        # once (possibly on different workers) can never both take the same
+        # turn. Returns the resulting game, its version and whether `change`
+        # modified it. With a nonce, a different game under the same code
+        # counts as missing.
+        while True:
+            game, version = self.get(code)
+            if game is None or nonce is not None and game.nonce != nonce:
+                return None, 0, False
+            if not change(game):
+                return game, version, False
+            if self.compare_and_set(code, game, version):
+                return game, version + 1, True
+
+    @abstractmethod
+    def get(self, code):
+        raise NotImplementedError
+
+    @abstractmethod
+    def stats(self):
+        # ({status: live games}, guesses held across all games)
+        raise NotImplementedError
+
+    @abstractmethod
+    def version(self, code):
+        raise NotImplementedError
+
+    @abstractmethod
+    def head(self, code):
+        # (version, nonce) of the game currently stored under `code`
+        raise NotImplementedError
+
+    @abstractmethod
+    def versions(self, codes):
+        # {code: version} for those of `codes` that are stored
+        raise NotImplementedError
+
+    @abstractmethod
+    def create(self, code, game):
+        raise NotImplementedError
+
+    @abstractmethod
+    def compare_and_set(self, code, game, version):
+        raise NotImplementedError
+
+    @abstractmethod
+    def code_key(self):
+        raise NotImplementedError
+
+    @abstractmethod
+    def next_code_index(self):
+        raise NotImplementedError
+
+    @abstractmethod
+    def pop_free_code(self):
+        raise NotImplementedError
+
+    @abstractmethod
+    def push_free_code(self, code):
+        raise NotImplementedError
+
+
+class MemoryGameStore(GameStore):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._games = {}
+        self._lock = threading.Lock()
+        # One LRU queue per TTL, oldest access first. Within a queue every
+        # entry has the same lifetime, so expired games are always at the
+        # front and eviction pops them without looking at live ones.
+        self._active = OrderedDict()
+        self._finished = OrderedDict()
+        self._code_key = random.getrandbits(32)
+        self._next_code = 0
+        self._free_codes = deque()
+        self._status_counts = [0] * len(STATUSES)
+        self._guess_count = 0
+        self.log = None
+
+    def _log(self, *event):
+        if self.log is not None:
+            self.log.append(event)
+
+    def attach_log(self, log):
+        # Recovery allocates hundreds of thousands of acyclic objects; running
+        # the cycle collector over them repeatedly would dominate startup.
+        gc.disable()
+        try:
+            self._recover(log)
+        finally:
+            gc.enable()
+        log.on_snapshot = self._snapshot
+
+    def _recover(self, log):
+        header, games, events = log.recover()
+        with self._lock:
+            if header is not None:
+                self._code_key = header["key"]
+                self._next_code = header["next_code"]
+                self._free_codes = deque(header["free_codes"])
+            for code, version, record in games:
+                self._games[code] = (version, Game.from_record(record))
+            for event in events:
+                self._replay(event)
+
+            now = time.monotonic()
+            for code, (version, game) in self._games.items():
+                self._count(game, 1)
+                self._touch(code, game, now)
+            self.log = log
+            if header is None and not events:
+                self._log("k", self._code_key)
+
+    def _replay(self, event):
+        # Games being replayed are not shared yet, so they are updated in place.
+        kind = event[0]
+        if kind == "k":
+            self._code_key = event[1]
+        elif kind == "c":
+            self._games[event[1]] = (1, Game.from_record(event[2]))
+        elif kind == "u":
+            version, game = self._games[event[1]]
+            apply_events(game, event[2])
+            self._games[event[1]] = (version + 1, game)
+        elif kind == "x":
+            self._games.pop(event[1], None)
+        elif kind == "n":
+            self._next_code += 1
+        elif kind == "p":
+            self._free_codes.popleft()
+        elif kind == "r":
+            self._free_codes.append(event[1])
+
+    def _snapshot(self):
+        with self._lock:
+            header = {
+                "segment": self.log.rotate(),
+                "key": self._code_key,
+                "next_code": self._next_code,
+                "free_codes": list(self._free_codes),
+            }
+            # Stored games are never mutated, so a shallow copy is a
+            # consistent view that can be written out without the lock.
+            games = list(self._games.items())
+        self.log.write_snapshot(header, games)
+
+    def _count(self, game, sign):
+        self._status_counts[game.status] += sign
+        self._guess_count += sign * len(game.guesses)
+
+    def _touch(self, code, game, now):
+        self._active.pop(code, None)
+        self._finished.pop(code, None)
+        queue = self._finished if game.status == FINISHED else self._active
+        queue[code] = self._expires_at(game, now)
+
+    def _evict(self, now):
+        evicted = []
+        for queue in (self._active, self._finished):
+            while queue:
+                code, expires_at = next(iter(queue.items()))
+                if expires_at > now:
+                    break
+                del queue[code]
+                self._count(self._games.pop(code)[1], -1)
+                self._log("x", code)
+                evicted.append(code)
+        return evicted
+
+    def get(self, code):
+        with self._lock:
+            entry = self._games.get(code)
+            if entry is None:
+                return None, 0
+            version, game = entry
+            self._touch(code, game, time.monotonic())
+            return game.copy(), version
+
+    def version(self, code):
+        entry = self._games.get(code)
+        return entry[0] if entry else 0
+
+    def head(self, code):
+        entry = self._games.get(code)
+        return (entry[0], entry[1].nonce) if entry else (0, None)
+
+    def versions(self, codes):
+        games = self._games
+        return {code: games[code][0] for code in codes if code in games}
+
+    def stats(self):
+        with self._lock:
+            return dict(enumerate(self._status_counts)), self._guess_count
+
+    def create(self, code, game):
+        now = time.monotonic()
+        with self._lock:
+            evicted = self._evict(now)
+            created = code not in self._games
+            if created:
+                self._games[code] = (1, game.copy())
+                self._count(game, 1)
+                self._log("c", code, game.to_record())
+                self._touch(code, game, now)
+        self._evicted(evicted)
+        return created
+
+    def compare_and_set(self, code, game, version):
+        now = time.monotonic()
+        with self._lock:
+            evicted = self._evict(now)
+            entry = self._games.get(code)
+            stored = entry is not None and entry[0] == version
+            if stored:
+                self._count(entry[1], -1)
+                self._count(game, 1)
+                self._log("u", code, update_events(entry[1], game))
+                self._games[code] = (version + 1, game.copy())
+                self._touch(code, game, now)
+        self._evicted(evicted)
+        return stored
+
+    def code_key(self):
+        return self._code_key
+
+    def next_code_index(self):
+        with self._lock:
+            index = self._next_code
+            self._next_code += 1
+            self._log("n")
+            return index
+
+    def pop_free_code(self):
+        with self._lock:
+            if not self._free_codes:
+                return None
+            self._log("p")
+            return self._free_codes.popleft()
+
+    def push_free_code(self, code):
+        with self._lock:
+            self._free_codes.append(code)
+            self._log("r", code)
+
+
+class SqliteGameStore(GameStore):
+    shared = True
+
+    # Expired rows removed per write; keeps eviction cost bounded per request.
+    EVICT_BATCH = 32
+    # Codes looked up per query by versions().
+    VERSIONS_BATCH = 500
+
+    def __init__(self, path, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        self._connections = {}  # native thread id -> connection
+        db = self._connect()
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS games ("
+            "code TEXT PRIMARY KEY, version INTEGER NOT NULL, data TEXT NOT NULL, "
+            "expires_at REAL NOT NULL)"
+        )
+        db.execute(
+            "CREATE INDEX IF NOT EXISTS games_expires_at ON games (expires_at)"
+        )
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS code_pool ("
+            "id INTEGER PRIMARY KEY CHECK (id = 0), next_index INTEGER NOT NULL, "
+            "key INTEGER NOT NULL)"
+        )
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS free_codes ("
+            "seq INTEGER PRIMARY KEY AUTOINCREMENT, code TEXT NOT NULL)"
+        )
+        db.execute(
+            "INSERT OR IGNORE INTO code_pool (id, next_index, key) VALUES (0, 0, ?)",
+            (random.getrandbits(32),),
+        )
+
+    def _connect(self):
+        # One connection per OS thread. Under gevent threading.local is per
+        # greenlet, which would give every open /events stream a connection
+        # of its own; greenlets never switch inside a statement, so the ones
+        # sharing a thread can share its connection.
+        thread = threading.get_native_id()
+        db = self._connections.get(thread)
+        if db is None:
+            db = sqlite3.connect(
+                self.path, timeout=30, isolation_level=None, check_same_thread=False
+            )
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._connections[thread] = db
+        return db
+
+    def _evict(self, now):
+        # Uses the expires_at index, so only expired rows are visited. Rows
+        # are refreshed on writes only; reads would otherwise need a write.
+        rows = self._connect().execute(
+            "DELETE FROM games WHERE code IN ("
+            "SELECT code FROM games WHERE expires_at <= ? LIMIT ?) RETURNING code",
+            (now, self.EVICT_BATCH),
+        ).fetchall()
+        self._evicted(code for code, in rows)
+
+    def get(self, code):
+        row = self._connect().execute(
+            "SELECT version, data FROM games WHERE code = ?", (code,)
+        ).fetchone()
+        if row is None:
+            return None, 0
+        return Game.from_record(json.loads(row[1])), row[0]
+
+    def version(self, code):
+        row = self._connect().execute(
+            "SELECT version FROM games WHERE code = ?", (code,)
+        ).fetchone()
+        return row[0] if row else 0
+
+    def head(self, code):
+        row = self._connect().execute(
+            "SELECT version, json_extract(data, '$[7]') FROM games WHERE code = ?",
+            (code,),
+        ).fetchone()
+        return (row[0], row[1]) if row else (0, None)
+
+    def versions(self, codes):
+        # Chunked to stay under SQLite's limit on bound parameters.
+        codes = list(codes)
+        versions = {}
+        for start in range(0, len(codes), self.VERSIONS_BATCH):
+            chunk = codes[start:start + self.VERSIONS_BATCH]
+            versions.update(self._connect().execute(
+                "SELECT code, version FROM games WHERE code IN (%s)"
+                % ",".join("?" * len(chunk)),
+                chunk,
+            ))
+        return versions
+
+    def stats(self):
+        # Scans every row, so only call this at scrape frequency.
+        rows = self._connect().execute(
+            "SELECT json_extract(data, '$[3]'), count(*), "
+            "sum(json_array_length(data, '$[5]')) FROM games GROUP BY 1"
+        ).fetchall()
+        return {status: count for status, count, _ in rows}, sum(row[2] for row in rows)
+
+    def create(self, code, game):
+        # Wall-clock time, since expiry is shared between processes.
+        now = time.time()
+        self._evict(now)
+        try:
+            self._connect().execute(
+                "INSERT INTO games (code, version, data, expires_at) VALUES (?, 1, ?, ?)",
+                (code, json.dumps(game.to_record()), self._expires_at(game, now)),
+            )
+        except sqlite3.IntegrityError:
+            return False
+        return True
+
+    def compare_and_set(self, code, game, version):
+        now = time.time()
+        self._evict(now)
+        cursor = self._connect().execute(
+            "UPDATE games SET data = ?, version = version + 1, expires_at = ? "
+            "WHERE code = ? AND version = ?",
+            (json.dumps(game.to_record()), self._expires_at(game, now), code, version),
+        )
+        return cursor.rowcount == 1
+
+    def code_key(self):
+        return self._connect().execute(
+            "SELECT key FROM code_pool WHERE id = 0"
+        ).fetchone()[0]
+
+    def next_code_index(self):
+        return self._connect().execute(
+            "UPDATE code_pool SET next_index = next_index + 1 WHERE id = 0 "
+            "RETURNING next_index - 1"
+        ).fetchone()[0]
+
+    def pop_free_code(self):
+        row = self._connect().execute(
+            "DELETE FROM free_codes WHERE seq = (SELECT MIN(seq) FROM free_codes) "
+            "RETURNING code"
+        ).fetchone()
+        return row[0] if row else None
+
+    def push_free_code(self, code):
+        self._connect().execute("INSERT INTO free_codes (code) VALUES (?)", (code,))
+
+
+def open_store(url=None):
+    url = url or os.environ.get("GAME_STORE", "memory")
+    if url == "memory":
+        store = MemoryGameStore()
+        if os.environ.get("GAME_LOG_DIR"):
+            store.attach_log(EventLog(os.environ["GAME_LOG_DIR"]))
+        return store
+    if url.startswith("sqlite:///"):
+        return SqliteGameStore(url[len("sqlite:///"):])
+    raise ValueError(f"Unknown game store: {url}")